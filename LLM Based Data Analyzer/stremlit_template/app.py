@@ -1,15 +1,23 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import asyncio
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
 
 # Import our custom modules
 from database_manager import DatabaseManager
 from sql_generator import SQLGenerator
 from visualization_engine import VisualizationEngine
 from insight_generator import InsightGenerator
+from llm_client import partial_json_string
 from sample_data import create_sample_database
-from config import APP_TITLE, APP_DESCRIPTION, SAMPLE_QUERIES, DATABASE_PATH
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from config import APP_TITLE, APP_DESCRIPTION, SAMPLE_QUERIES, DATABASE_PATH, MAX_QUERY_RESULTS
 
 # Page configuration
 st.set_page_config(
@@ -19,51 +27,84 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for better styling
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        text-align: center;
-        margin-bottom: 1rem;
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-    }
-    .chat-message {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin: 1rem 0;
-        border-left: 4px solid #667eea;
-        background-color: #f8f9fa;
-    }
-    .success-message {
-        border-left-color: #28a745;
-        background-color: #d4edda;
-    }
-    .error-message {
-        border-left-color: #dc3545;
-        background-color: #f8d7da;
-    }
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource(show_spinner=False)
+def _custom_css() -> str:
+    """The app stylesheet, read from disk once per process."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "style.css"), encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+# Custom CSS for better styling; st.html injects style-only content without
+# markdown parsing or taking up space in the layout
+st.html(_custom_css())
+
+@st.cache_resource(show_spinner=False)
+def get_db_manager() -> DatabaseManager:
+    """Process-wide DatabaseManager; its read-only connection is shared by all sessions."""
+    return DatabaseManager()
+
+@st.cache_resource(show_spinner=False)
+def get_sql_generator(schema_info: str) -> SQLGenerator:
+    """Process-wide SQLGenerator pinned to a schema, keeping its OpenAI HTTP connection pool warm."""
+    return SQLGenerator(get_db_manager(), schema_info=schema_info)
+
+@st.cache_resource(show_spinner=False)
+def get_viz_engine() -> VisualizationEngine:
+    """Process-wide VisualizationEngine."""
+    return VisualizationEngine()
+
+@st.cache_resource(show_spinner=False)
+def get_insight_generator() -> InsightGenerator:
+    """Process-wide InsightGenerator, keeping its OpenAI HTTP connection pool warm."""
+    return InsightGenerator()
+
+def _db_mtime(db_path: str = DATABASE_PATH) -> float:
+    """Modification time of the database file, used to invalidate cached metadata."""
+    return os.path.getmtime(db_path) if os.path.exists(db_path) else 0.0
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_metadata(db_path: str, mtime: float) -> Dict[str, Any]:
+    """Tables, schema and sample rows for the sidebar and info panel, memoized per (db_path, mtime)."""
+    with DatabaseManager(db_path) as db_manager:
+        return db_manager.get_metadata()
+
+@st.cache_data(ttl=86400, show_spinner=False)
+async def _cached_generate_insights(_insight_generator: InsightGenerator, sql_query: str, df_hash: int, _df: pd.DataFrame, _on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """LLM insights, memoized per (SQL string, result contents); API errors raise, so they are never cached."""
+    return await _insight_generator.agenerate_insights(sql_query, _df, on_delta=_on_delta, raise_errors=True)
+
+@st.cache_resource(ttl=3600, max_entries=256, show_spinner=False)
+def _stored_result(result_id: str, _table: Optional[pa.Table] = None) -> Optional[pa.Table]:
+    """
+    Query results kept out of session state and looked up by id.
+    
+    Results are stored as Arrow tables, the format st.dataframe sends to the
+    browser, so redisplaying them skips the pandas conversion. Arrow tables
+    are immutable, so the cache hands out the stored object itself rather
+    than unpickling a copy on every rerun. The first call with a table
+    stores it; later calls with just the id return it, or None once the
+    entry has been evicted.
+    """
+    return _table
 
 class DataAnalystApp:
     """Main application class for the AI Data Analyst Assistant."""
     
     def __init__(self):
-        self.db_manager = DatabaseManager()
-        self.sql_generator = SQLGenerator()
-        self.viz_engine = VisualizationEngine()
-        self.insight_generator = InsightGenerator()
-        
         # Initialize session state
         self._initialize_session_state()
         
-        # Initialize database
+        # Initialize database before anything connects, so connecting cannot fail on a missing file
         self._initialize_database()
+        
+        # The schema text is computed once per session and keeps SQL prompts off the database
+        if 'schema_info' not in st.session_state:
+            st.session_state.schema_info = _cached_metadata(DATABASE_PATH, _db_mtime())['schema']
+        
+        # Engines are built once per process rather than on every rerun
+        self.db_manager = get_db_manager()
+        self.sql_generator = get_sql_generator(st.session_state.schema_info)
+        self.viz_engine = get_viz_engine()
+        self.insight_generator = get_insight_generator()
     
     def _initialize_session_state(self):
         """Initialize Streamlit session state variables."""
@@ -79,6 +120,53 @@ class DataAnalystApp:
                 create_sample_database(DATABASE_PATH)
                 st.success("Sample database created successfully!")
     
+    def _generate_sql(self, user_query: str, on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str, str]:
+        """Generate validated SQL and its explanation; SQLGenerator caches answers per (question, schema)."""
+        # Dry-runs the SQL locally and spends at most one corrective call on it
+        return self.sql_generator.generate_and_validate(user_query, on_delta=on_delta)
+    
+    @staticmethod
+    def _render_sql_draft(draft: str):
+        """Show the SQL and explanation from a JSON answer that is still streaming in."""
+        st.code(partial_json_string(draft, "sql"), language='sql')
+        explanation = partial_json_string(draft, "explanation")
+        if explanation:
+            st.markdown(f"**What this query does:** {explanation}")
+    
+    @staticmethod
+    def _executor(max_workers: int) -> ThreadPoolExecutor:
+        """Thread pool whose workers share this script run's context, so st.* calls work."""
+        return ThreadPoolExecutor(
+            max_workers=max_workers,
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx())
+        )
+    
+    async def _analyze_results(self, sql_query: str, df: pd.DataFrame, on_insight_delta: Optional[Callable[[str], None]] = None, query_explanation: Optional[str] = None, on_explanation_delta: Optional[Callable[[str], None]] = None) -> Tuple[Any, str, str]:
+        """Build the (figure, widget) pair, insights and (unless already known) explanation for a result set concurrently."""
+        df_hash = int(pd.util.hash_pandas_object(df).sum())
+        
+        with self._executor(max_workers=1) as executor:
+            # Plotly work is CPU-bound, so it goes to a thread; the LLM calls share the event loop
+            figure_task = asyncio.get_running_loop().run_in_executor(
+                executor, self.viz_engine.create_visualization, df, sql_query
+            )
+            # on_insight_delta must not call st.*: the cache would record and replay it
+            insights_task = self._generate_insights(sql_query, df_hash, df, on_insight_delta)
+            if query_explanation is not None:
+                visualization, insights = await asyncio.gather(figure_task, insights_task)
+                return visualization, insights, query_explanation
+            
+            explanation_task = self.sql_generator.aexplain_query(sql_query, on_delta=on_explanation_delta)
+            return await asyncio.gather(figure_task, insights_task, explanation_task)
+    
+    async def _generate_insights(self, sql_query: str, df_hash: int, df: pd.DataFrame, on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """Cached insights, falling back to local ones (outside the cache) when the LLM call fails."""
+        try:
+            return await _cached_generate_insights(self.insight_generator, sql_query, df_hash, df, on_delta)
+        except Exception as e:
+            return self.insight_generator.fallback_insights(e, df)
+    
     def run(self):
         """Main application entry point."""
         
@@ -106,7 +194,7 @@ class DataAnalystApp:
         # Database schema
         with st.sidebar.expander("View Database Schema", expanded=False):
             try:
-                schema_info = self.db_manager.get_schema_info()
+                schema_info = _cached_metadata(DATABASE_PATH, _db_mtime())['schema']
                 st.code(schema_info, language="sql")
             except Exception as e:
                 st.error(f"Error loading schema: {e}")
@@ -115,10 +203,9 @@ class DataAnalystApp:
         st.sidebar.header("💡 Sample Questions")
         st.sidebar.markdown("Try asking these questions:")
         
+        # Callbacks run before the rerun the click triggers, so no extra st.rerun() is needed
         for i, query in enumerate(SAMPLE_QUERIES):
-            if st.sidebar.button(f"📊 {query}", key=f"sample_{i}"):
-                st.session_state.current_query = query
-                st.rerun()
+            st.sidebar.button(f"📊 {query}", key=f"sample_{i}", on_click=self._set_query, args=(query,))
         
         # Settings
         st.sidebar.header("⚙️ Settings")
@@ -131,23 +218,42 @@ class DataAnalystApp:
             st.sidebar.warning("Set OPENAI_API_KEY environment variable for AI features")
         
         # Clear chat history
-        if st.sidebar.button("🗑️ Clear Chat History"):
-            st.session_state.chat_history = []
-            st.session_state.query_count = 0
-            st.rerun()
+        st.sidebar.button("🗑️ Clear Chat History", on_click=self._clear_chat_history)
+    
+    @staticmethod
+    def _set_query(query: str):
+        """Button callback that fills the query input."""
+        st.session_state.query_input = query
+    
+    @staticmethod
+    def _clear_chat_history():
+        """Button callback that resets the conversation."""
+        st.session_state.chat_history = []
+        st.session_state.query_count = 0
+        # A query still running in the background finishes, but its answer is dropped
+        st.session_state.pop('pending_query', None)
     
     def _render_chat_interface(self):
         """Render the main chat interface."""
         
         st.header("💬 Ask Your Data Questions")
         
+        # The answer being worked on goes above the history, which is newest first
+        if 'pending_query' in st.session_state:
+            self._render_pending_query()
+        
         # Display chat history
         self._display_chat_history()
         
+        self._render_query_input()
+    
+    @st.fragment
+    def _render_query_input(self):
+        """Render the query box and actions; typing and the example button only rerun this fragment."""
+        
         # Query input
         query_input = st.text_input(
             "What would you like to know about your data?",
-            value=st.session_state.get('current_query', ''),
             placeholder="e.g., Show me total sales by month",
             key="query_input"
         )
@@ -156,12 +262,9 @@ class DataAnalystApp:
         col1, col2, col3 = st.columns([2, 1, 1])
         
         with col1:
-            if st.button("🚀 Analyze Data", type="primary"):
+            if st.button("🚀 Analyze Data", type="primary", disabled='pending_query' in st.session_state):
                 if query_input.strip():
                     self._process_query(query_input.strip())
-                    # Clear the current_query from session state
-                    if 'current_query' in st.session_state:
-                        del st.session_state.current_query
                 else:
                     st.warning("Please enter a question about your data.")
         
@@ -171,10 +274,14 @@ class DataAnalystApp:
                     self._generate_sql_only(query_input.strip())
         
         with col3:
-            if st.button("📋 Example"):
-                st.session_state.current_query = SAMPLE_QUERIES[0]
-                st.rerun()
+            st.button("📋 Example", on_click=self._set_query, args=(SAMPLE_QUERIES[0],))
+    
+    def _append_to_history(self, message: dict):
+        """Add a message to the chat history under a stable id used to key its elements."""
+        message['id'] = uuid.uuid4().hex
+        st.session_state.chat_history.append(message)
     
+    @st.fragment
     def _display_chat_history(self):
         """Display the chat history."""
         
@@ -183,100 +290,164 @@ class DataAnalystApp:
             return
         
         # Display messages in reverse order (newest first)
-        for i, message in enumerate(reversed(st.session_state.chat_history)):
+        for message in reversed(st.session_state.chat_history):
             timestamp = message.get('timestamp', 'Unknown time')
             
             if message['type'] == 'user':
-                st.markdown(f"""
-                <div class="chat-message">
-                    <strong>🧑 You ({timestamp}):</strong><br>
-                    {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
+                with st.chat_message("user"):
+                    st.caption(f"You ({timestamp})")
+                    st.markdown(message['content'])
             
             elif message['type'] == 'assistant':
-                success_class = "success-message" if message.get('success', True) else "error-message"
-                st.markdown(f"""
-                <div class="chat-message {success_class}">
-                    <strong>🤖 AI Assistant ({timestamp}):</strong><br>
-                    {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Display SQL query if available
-                if 'sql' in message:
-                    st.code(message['sql'], language='sql')
-                
-                # Display visualization if available
-                if 'figure' in message:
-                    st.plotly_chart(message['figure'], use_container_width=True)
-                
-                # Display data table if available
-                if 'dataframe' in message and not message['dataframe'].empty:
-                    with st.expander("📊 View Raw Data", expanded=False):
-                        st.dataframe(message['dataframe'], use_container_width=True)
+                with st.chat_message("assistant"):
+                    st.caption(f"AI Assistant ({timestamp})")
+                    if message.get('success', True):
+                        st.markdown(message['content'])
+                    else:
+                        st.error(message['content'])
+                    
+                    # Display SQL query if available
+                    if 'sql' in message:
+                        st.code(message['sql'], language='sql')
+                    
+                    # Keyed on the message id, so earlier charts keep their identity across reruns
+                    if 'figure' in message:
+                        st.plotly_chart(message['figure'], width="stretch", key=f"figure_{message['id']}")
+                    
+                    # Results live in the cache, not session state; only load them when asked,
+                    # except for table-shaped results, which go straight to st.dataframe
+                    if 'result_id' in message and (
+                        message.get('widget') == 'dataframe'
+                        or st.toggle("📊 View Raw Data", key=f"show_data_{message['id']}")
+                    ):
+                        self._render_result_table(message)
+    
+    @st.fragment
+    def _render_result_table(self, message: dict):
+        """Show a stored result one page of MAX_QUERY_RESULTS rows at a time; paging only reruns this fragment."""
+        
+        table = _stored_result(message['result_id'])
+        if table is None:
+            st.caption("These results are no longer cached. Ask the question again to reload them.")
+            return
+        
+        page_count = max(1, -(-table.num_rows // MAX_QUERY_RESULTS))
+        page = 1
+        if page_count > 1:
+            page = st.number_input(
+                f"Page (of {page_count})", min_value=1, max_value=page_count, step=1,
+                key=f"data_page_{message['id']}"
+            )
+        
+        # Slicing an Arrow table is zero-copy, so only the visible page is sent
+        st.dataframe(
+            table.slice((page - 1) * MAX_QUERY_RESULTS, MAX_QUERY_RESULTS),
+            width="stretch", key=f"data_{message['id']}"
+        )
     
     def _process_query(self, user_query: str):
-        """Process a user query end-to-end."""
+        """Start answering a user query on a background thread, so the app stays responsive."""
         
         timestamp = datetime.now().strftime("%H:%M:%S")
         
         # Add user message to chat history
-        st.session_state.chat_history.append({
+        self._append_to_history({
             'type': 'user',
             'content': user_query,
             'timestamp': timestamp
         })
         
+        # The worker only writes to this dict; _render_pending_query polls it
+        # and moves the finished answer into the chat history
+        job = {'status': "🧠 Converting your question to SQL...", 'draft': "", 'sql': "", 'explanation': "", 'insights': "", 'result': None}
+        worker = threading.Thread(target=self._run_query_job, args=(job, user_query, timestamp), daemon=True)
+        # Cached helpers need the script run context, which plain threads don't inherit
+        add_script_run_ctx(worker, get_script_run_ctx())
+        job['thread'] = worker
+        st.session_state.pending_query = job
+        worker.start()
+        
+        st.rerun()
+    
+    def _run_query_job(self, job: dict, user_query: str, timestamp: str):
+        """Thread target: answer the query, always leaving an assistant message in the job."""
+        try:
+            # The chain's LLM calls are sent to llm_client's shared loop, so they reuse one AsyncOpenAI pool
+            job['result'] = asyncio.run(self._answer_query(job, user_query, timestamp))
+        except Exception as e:
+            job['result'] = {
+                'type': 'assistant',
+                'content': f"❌ **Error processing query:** {str(e)}",
+                'timestamp': timestamp,
+                'success': False
+            }
+    
+    async def _answer_query(self, job: dict, user_query: str, timestamp: str) -> dict:
+        """Process a user query end-to-end and build the assistant message; runs off the script thread."""
+        
         # Generate SQL
-        with st.spinner("🧠 Converting your question to SQL..."):
-            sql_query, sql_error = self.sql_generator.generate_sql(user_query)
+        def on_sql_delta(chunk: str):
+            job['draft'] += chunk
+        
+        # No validation pass: executing the query below reports any SQL error
+        sql_query, query_explanation, sql_error = await self.sql_generator.agenerate_sql_and_explanation(
+            user_query, validate=False, on_delta=on_sql_delta
+        )
         
         if sql_error:
             # Handle SQL generation error
             error_message = f"❌ **Error generating SQL:** {sql_error}"
-            st.session_state.chat_history.append({
+            return {
                 'type': 'assistant',
                 'content': error_message,
                 'timestamp': timestamp,
                 'success': False
-            })
-            st.rerun()
-            return
+            }
         
         # Execute SQL
-        with st.spinner("📊 Executing query..."):
-            df, exec_error = self.db_manager.execute_query(sql_query)
+        job['status'] = "📊 Executing query..."
+        df, exec_error = self.db_manager.execute_query(sql_query)
         
         if exec_error:
             # Try to improve the query
-            with st.spinner("🔧 Attempting to fix the query..."):
-                improved_sql, improve_error = self.sql_generator.improve_query(sql_query, exec_error, user_query)
+            job['status'] = "🔧 Attempting to fix the query..."
+            improved_sql, improve_error = await self.sql_generator.aimprove_query(sql_query, exec_error, user_query)
             
             if not improve_error:
                 df, exec_error = self.db_manager.execute_query(improved_sql)
                 if not exec_error:
                     sql_query = improved_sql  # Use the improved query
+                    query_explanation = None  # It no longer matches; explain the fixed query
+                    job['sql'] = sql_query  # The draft shows the failed query; show the fix instead
+                    # Repeats of the question get the working query straight from the cache
+                    self.sql_generator.remember_sql(user_query, sql_query)
         
         if exec_error:
             error_message = f"❌ **Query execution failed:** {exec_error}"
-            st.session_state.chat_history.append({
+            return {
                 'type': 'assistant',
                 'content': error_message,
                 'sql': sql_query,
                 'timestamp': timestamp,
                 'success': False
-            })
-            st.rerun()
-            return
+            }
         
-        # Generate visualization
-        with st.spinner("📈 Creating visualization..."):
-            figure = self.viz_engine.create_visualization(df, sql_query)
+        # Visualization, insights and explanation only depend on the results,
+        # so overlap the LLM round-trips with each other and the local Plotly work
+        job['status'] = "📈 Creating visualization and analyzing results..."
         
-        # Generate insights
-        with st.spinner("🔍 Analyzing results..."):
-            insights = self.insight_generator.generate_insights(sql_query, df)
+        def on_insight_delta(chunk: str):
+            job['insights'] += chunk
+        
+        def on_explanation_delta(chunk: str):
+            job['explanation'] += chunk
+        
+        # A cached correction comes back without an explanation, so explain it now
+        (figure, widget), insights, query_explanation = await self._analyze_results(
+            sql_query, df, on_insight_delta, query_explanation or None, on_explanation_delta
+        )
+        
+        suggestions = self.insight_generator.generate_query_suggestions(sql_query, df)
         
         # Prepare response message
         response_parts = []
@@ -287,14 +458,12 @@ class DataAnalystApp:
             response_parts.append("✅ **Query executed successfully** but returned no results.")
         
         # Add query explanation
-        query_explanation = self.sql_generator.explain_query(sql_query)
         response_parts.append(f"\n**What this query does:** {query_explanation}")
         
         # Add insights
         response_parts.append(f"\n**📊 Insights:**\n{insights}")
         
         # Add suggestions for follow-up queries
-        suggestions = self.insight_generator.generate_query_suggestions(sql_query, df)
         if suggestions:
             response_parts.append(f"\n**💡 Suggested follow-up questions:**")
             for suggestion in suggestions[:3]:
@@ -312,11 +481,42 @@ class DataAnalystApp:
         if figure:
             assistant_message['figure'] = figure
         
+        if widget:
+            assistant_message['widget'] = widget
+        
         if not df.empty:
-            assistant_message['dataframe'] = df
+            result_id = uuid.uuid4().hex
+            _stored_result(result_id, pa.Table.from_pandas(df, preserve_index=False))
+            assistant_message['result_id'] = result_id
+        
+        return assistant_message
+    
+    @st.fragment(run_every=0.5)
+    def _render_pending_query(self):
+        """Show progress for the background query, then hand its answer to the chat history."""
+        
+        job = st.session_state.get('pending_query')
+        if job is None:
+            return
+        
+        if job['thread'].is_alive():
+            with st.chat_message("assistant"):
+                st.caption("AI Assistant (working...)")
+                st.markdown(job['status'])
+                if job['sql']:
+                    st.code(job['sql'], language='sql')
+                elif job['draft']:
+                    self._render_sql_draft(job['draft'])
+                if job['explanation']:
+                    st.markdown(f"**What this query does:** {job['explanation']}")
+                if job['insights']:
+                    st.markdown(f"**📊 Insights:**\n{job['insights']}")
+            return
         
-        st.session_state.chat_history.append(assistant_message)
-        st.session_state.query_count += 1
+        del st.session_state.pending_query
+        self._append_to_history(job['result'])
+        if job['result']['success']:
+            st.session_state.query_count += 1
         
         st.rerun()
     
@@ -326,34 +526,53 @@ class DataAnalystApp:
         timestamp = datetime.now().strftime("%H:%M:%S")
         
         # Add user message
-        st.session_state.chat_history.append({
+        self._append_to_history({
             'type': 'user',
             'content': f"[SQL Only] {user_query}",
             'timestamp': timestamp
         })
         
-        # Generate SQL
+        # Generate SQL, showing it as it streams in
+        draft_placeholder = st.empty()
+        draft = []
+        
+        def on_delta(chunk: str):
+            draft.append(chunk)
+            with draft_placeholder.container():
+                self._render_sql_draft("".join(draft))
+        
         with st.spinner("🧠 Converting your question to SQL..."):
-            sql_query, sql_error = self.sql_generator.generate_sql(user_query)
+            sql_query, query_explanation, sql_error = self._generate_sql(user_query, on_delta)
         
-        if sql_error:
+        if not sql_query:
             error_message = f"❌ **Error generating SQL:** {sql_error}"
-            st.session_state.chat_history.append({
+            self._append_to_history({
                 'type': 'assistant',
                 'content': error_message,
                 'timestamp': timestamp,
                 'success': False
             })
         else:
-            # Validate the SQL
-            is_valid, validation_message = self.db_manager.validate_query(sql_query)
+            is_valid = not sql_error
+            
+            if is_valid and not query_explanation:
+                # A corrected query comes back without an explanation; stream one in below the SQL
+                draft_placeholder.code(sql_query, language='sql')
+                explanation_placeholder = st.empty()
+                explanation = []
+                
+                def on_explanation_delta(chunk: str):
+                    explanation.append(chunk)
+                    explanation_placeholder.markdown(f"**Explanation:** {''.join(explanation)}")
+                
+                query_explanation = self.sql_generator.explain_query(sql_query, on_delta=on_explanation_delta)
             
             if is_valid:
-                response = f"✅ **SQL generated successfully:**\n\n**Explanation:** {self.sql_generator.explain_query(sql_query)}"
+                response = f"✅ **SQL generated successfully:**\n\n**Explanation:** {query_explanation}"
             else:
-                response = f"⚠️ **SQL generated but validation failed:** {validation_message}"
+                response = f"⚠️ **SQL generated but validation failed:** {sql_error}"
             
-            st.session_state.chat_history.append({
+            self._append_to_history({
                 'type': 'assistant',
                 'content': response,
                 'sql': sql_query,
@@ -376,19 +595,20 @@ class DataAnalystApp:
         st.header("🗄️ Database Overview")
         
         try:
-            with self.db_manager:
-                table_names = self.db_manager.get_table_names()
-                
-                st.markdown("**Available Tables:**")
-                for table in table_names:
-                    st.markdown(f"• {table}")
-                
-                # Show sample data from first table
-                if table_names:
-                    st.markdown(f"\n**Sample from {table_names[0]}:**")
-                    sample_df, _ = self.db_manager.execute_query(f"SELECT * FROM {table_names[0]} LIMIT 3")
-                    if not sample_df.empty:
-                        st.dataframe(sample_df, use_container_width=True)
+            # Same cached metadata as the sidebar schema, so no extra queries
+            metadata = _cached_metadata(DATABASE_PATH, _db_mtime())
+            table_names = metadata['tables']
+            
+            st.markdown("**Available Tables:**")
+            for table in table_names:
+                st.markdown(f"• {table}")
+            
+            # Show sample data from first table
+            if table_names:
+                st.markdown(f"\n**Sample from {table_names[0]}:**")
+                sample_df = metadata['samples'][table_names[0]]
+                if not sample_df.empty:
+                    st.dataframe(sample_df, width="stretch")
         
         except Exception as e:
             st.error(f"Error loading database info: {e}")
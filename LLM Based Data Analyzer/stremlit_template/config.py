@@ -3,12 +3,22 @@ from typing import Dict, Any
 
 # API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-api-key-here")
-MODEL_NAME = "gpt-4"
+MODEL_NAME = "gpt-4o"  # JSON mode (response_format) needs gpt-4o or newer
+EXPLAIN_MODEL_NAME = "gpt-4o-mini"  # Explanations are simple rephrasings; a small model decodes faster
 TEMPERATURE = 0  # Deterministic SQL generation
+OPENAI_TIMEOUT = 15.0  # Seconds to wait for each response read before giving up
+OPENAI_CONNECT_TIMEOUT = 3.0
+OPENAI_MAX_RETRIES = 3  # Retries with exponential backoff on rate limits, timeouts and 5xx errors
+# Persistent LLM cache (needs diskcache); "" disables it. diskcache unpickles what it reads,
+# so the default lives under the user's home rather than a shared, world-writable /tmp path
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai_data_analyst", "llm"))
+LLM_CACHE_TTL = 86400  # Seconds a persisted LLM response stays valid
 
 # Database Configuration
 DATABASE_PATH = "data_analyst.db"
+DATABASE_IMMUTABLE = False  # Only set True for a file nothing rewrites: immutable connections never see changes, including WAL commits
 MAX_QUERY_RESULTS = 100
+SCHEMA_CACHE_TTL = 300  # Seconds a SQLGenerator reuses the schema text before re-reading it
 
 # Application Settings
 APP_TITLE = "🤖 AI Data Analyst Assistant"
@@ -27,7 +37,7 @@ SAMPLE_QUERIES = [
 ]
 
 # SQL Generation Prompts
-SYSTEM_PROMPT = """You are an expert SQL analyst. Convert natural language questions to SQL queries.
+_SQL_RULES_PROMPT = """You are an expert SQL analyst. Convert natural language questions to SQL queries.
 
 IMPORTANT RULES:
 1. Only generate SELECT queries (no INSERT, UPDATE, DELETE)
@@ -35,12 +45,21 @@ IMPORTANT RULES:
 3. Include appropriate WHERE, GROUP BY, ORDER BY clauses as needed
 4. Limit results to 100 rows maximum
 5. Use table and column names exactly as provided in the schema
+6. For distributions, shares, rankings or top-N questions, aggregate with GROUP BY and return only the rows needed (ORDER BY ... LIMIT 20) rather than raw rows
 
 Available Tables and Schema:
-{schema_info}
+{schema_info}"""
+
+SYSTEM_PROMPT = _SQL_RULES_PROMPT + """
 
 Generate only the SQL query without explanations or markdown formatting."""
 
+SQL_AND_EXPLANATION_PROMPT = _SQL_RULES_PROMPT + """
+
+Respond with a JSON object with exactly two keys:
+- "sql": the SQL query, without markdown formatting
+- "explanation": what the query does in at most 3 sentences, in simple business-friendly language a non-technical person would understand"""
+
 INSIGHT_PROMPT = """Analyze the following SQL query results and provide business insights in plain English.
 
 Query: {query}
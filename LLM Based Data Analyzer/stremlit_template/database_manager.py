@@ -1,23 +1,139 @@
+import re
 import sqlite3
 import pandas as pd
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
 from typing import List, Dict, Any, Tuple, Optional
-from config import DATABASE_PATH, MAX_QUERY_RESULTS
+from config import DATABASE_PATH, DATABASE_IMMUTABLE, MAX_QUERY_RESULTS
+
+_SELECT_RE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+_LIMIT_RE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+# Blanked out before keyword checks, so "-- no LIMIT" or 'LIMIT' in a string doesn't count
+_LITERALS_AND_COMMENTS_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+@dataclass(frozen=True)
+class QueryInfo:
+    """Keyword checks for a SQL string, shared by validation and execution."""
+    starts_with_select: bool
+    has_limit: bool
+
+@lru_cache(maxsize=256)
+def _classify_query(query: str) -> QueryInfo:
+    """Classify a query once; the same SQL is usually validated and then executed."""
+    return QueryInfo(
+        starts_with_select=_SELECT_RE.match(query) is not None,
+        has_limit=_LIMIT_RE.search(_LITERALS_AND_COMMENTS_RE.sub(' ', query)) is not None
+    )
+
+def _strip_statement_end(query: str) -> str:
+    """
+    The query without its trailing comments, whitespace and semicolons, so a clause can be appended.
+    
+    Comments are blanked (keeping offsets) before looking for the end, so
+    "SELECT ...; -- note" loses the comment as well as the semicolon.
+    """
+    masked = _LITERALS_AND_COMMENTS_RE.sub(
+        lambda m: m.group() if m.group().startswith("'") else " " * len(m.group()), query
+    )
+    end = masked.rstrip()
+    while end.endswith(";"):
+        end = end[:-1].rstrip()
+    return query[:len(end)]
 
 class DatabaseManager:
     """Manages database connections and operations for the data analyst assistant."""
     
-    def __init__(self, db_path: str = DATABASE_PATH):
+    # Applied once per connection; they only affect how SQLite caches and syncs pages
+    CONNECTION_PRAGMAS = [
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA cache_size=-65536",  # 64 MiB page cache (negative values are KiB)
+    ]
+    
+    # Actions a statement may compile to; SQLite refuses anything else at prepare time
+    READ_ONLY_ACTIONS = {
+        sqlite3.SQLITE_SELECT,
+        sqlite3.SQLITE_READ,
+        sqlite3.SQLITE_FUNCTION,
+        sqlite3.SQLITE_RECURSIVE,
+    }
+    
+    # Introspection pragmas used by the schema helpers
+    READ_ONLY_PRAGMAS = {"table_info"}
+    
+    # All tables' columns in one statement, in creation and column order
+    SCHEMA_QUERY = """
+        SELECT m.name, p.name, p.type, p."notnull"
+        FROM sqlite_master AS m
+        JOIN pragma_table_info(m.name) AS p
+        WHERE m.type = 'table'
+        ORDER BY m.rowid, p.cid
+    """
+    
+    NOT_AUTHORIZED_MESSAGE = "Query performs a forbidden operation. Only SELECT queries are allowed."
+    
+    def __init__(self, db_path: str = DATABASE_PATH, connection: Optional[sqlite3.Connection] = None):
         self.db_path = db_path
-        self.connection = None
+        self.connection = connection
+        if self.connection is None:
+            self.connect()
+        
+    def connect(self, read_only: bool = True, immutable: bool = DATABASE_IMMUTABLE) -> sqlite3.Connection:
+        """
+        Establish database connection, reusing the open one if present.
+        
+        Args:
+            read_only: Open the file with mode=ro, so SQLite skips write locks and journaling
+            immutable: Also promise SQLite the file never changes, so it skips locking
+                and change detection entirely; only safe while nothing else writes to it
+            
+        Returns:
+            The open connection
+        """
+        if self.connection:
+            return self.connection
         
-    def connect(self) -> None:
-        """Establish database connection."""
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            if read_only:
+                database = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+                if immutable:
+                    database += "&immutable=1"
+            else:
+                database = self.db_path
+            
+            # Shared across Streamlit reruns, which may run on different threads
+            self.connection = sqlite3.connect(database, uri=read_only, check_same_thread=False)
             self.connection.row_factory = sqlite3.Row  # Enable column access by name
+            if not read_only:
+                # Changing the journal mode is a write, so read-only connections keep the file's mode
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            for pragma in self.CONNECTION_PRAGMAS:
+                self.connection.execute(pragma)
+            self.connection.set_authorizer(self._authorize)
+            return self.connection
         except sqlite3.Error as e:
             raise Exception(f"Failed to connect to database: {e}")
     
+    @classmethod
+    def _authorize(cls, action: int, arg1: Optional[str], arg2: Optional[str], db_name: Optional[str], trigger: Optional[str]) -> int:
+        """SQLite authorizer callback that only lets read-only statements compile."""
+        if action in cls.READ_ONLY_ACTIONS:
+            return sqlite3.SQLITE_OK
+        if action == sqlite3.SQLITE_PRAGMA and arg1 in cls.READ_ONLY_PRAGMAS:
+            return sqlite3.SQLITE_OK
+        if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master":
+            # Reported when a table-valued pragma registers its virtual table on first use;
+            # real writes to the schema table are refused by SQLite on a read-only connection
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    
+    @staticmethod
+    def quote_identifier(name: str) -> str:
+        """Quote a table or column name for places where SQL cannot take a bound parameter."""
+        return '"' + name.replace('"', '""') + '"'
+    
     def disconnect(self) -> None:
         """Close database connection."""
         if self.connection:
@@ -26,43 +142,48 @@ class DatabaseManager:
     
     def get_schema_info(self) -> str:
         """Get comprehensive schema information for all tables."""
-        if not self.connection:
-            self.connect()
+        return self.get_metadata()['schema']
+    
+    def get_metadata(self) -> Dict[str, Any]:
+        """
+        Collect table names, schema description and sample rows in one pass.
         
+        Returns:
+            Dict with 'tables' (table names), 'schema' (the get_schema_info text)
+            and 'samples' (table name -> DataFrame of up to 3 rows)
+        """
         cursor = self.connection.cursor()
         schema_info = []
+        samples: Dict[str, pd.DataFrame] = {}
         
-        # Get all table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
+        # Get column information for every table with a single query
+        cursor.execute(self.SCHEMA_QUERY)
+        columns_by_table: Dict[str, List[Tuple[str, str, int]]] = {}
+        for table_name, col_name, col_type, not_null in cursor.fetchall():
+            columns_by_table.setdefault(table_name, []).append((col_name, col_type, not_null))
         
-        for table in tables:
-            table_name = table[0]
+        for table_name, columns in columns_by_table.items():
             schema_info.append(f"\nTable: {table_name}")
             
-            # Get column information
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = cursor.fetchall()
-            
-            for column in columns:
-                col_name = column[1]
-                col_type = column[2]
-                is_nullable = "NOT NULL" if column[3] else "NULL"
+            for col_name, col_type, not_null in columns:
+                is_nullable = "NOT NULL" if not_null else "NULL"
                 schema_info.append(f"  - {col_name}: {col_type} ({is_nullable})")
             
             # Get sample values for better context
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT 3")
+            cursor.execute(f"SELECT * FROM {self.quote_identifier(table_name)} LIMIT 3")
             sample_rows = cursor.fetchall()
+            col_names = [description[0] for description in cursor.description]
+            samples[table_name] = pd.DataFrame.from_records([tuple(row) for row in sample_rows], columns=col_names)
             if sample_rows:
                 schema_info.append("  Sample data:")
-                for i, row in enumerate(sample_rows):
-                    if i == 0:  # Show column names for first row
-                        col_names = [description[0] for description in cursor.description]
-                        schema_info.append(f"    {dict(zip(col_names, row))}")
-                    else:
-                        schema_info.append(f"    {dict(zip(col_names, row))}")
+                for row in sample_rows:
+                    schema_info.append(f"    {dict(zip(col_names, row))}")
         
-        return "\n".join(schema_info)
+        return {
+            'tables': list(columns_by_table),
+            'schema': "\n".join(schema_info),
+            'samples': samples
+        }
     
     def execute_query(self, query: str) -> Tuple[pd.DataFrame, str]:
         """
@@ -74,31 +195,35 @@ class DatabaseManager:
         Returns:
             Tuple of (DataFrame with results, error message if any)
         """
-        if not self.connection:
-            self.connect()
-        
         try:
             # Security check - only allow SELECT queries
-            query_upper = query.strip().upper()
-            if not query_upper.startswith('SELECT'):
+            query_info = _classify_query(query)
+            if not query_info.starts_with_select:
                 return pd.DataFrame(), "Error: Only SELECT queries are allowed for security reasons."
             
-            # Add LIMIT if not present
-            if 'LIMIT' not in query_upper:
-                query += f" LIMIT {MAX_QUERY_RESULTS}"
+            # Add LIMIT if not present, after any trailing comment and semicolon
+            if not query_info.has_limit:
+                query = f"{_strip_statement_end(query)}\nLIMIT {MAX_QUERY_RESULTS}"
             
-            # Execute query
-            df = pd.read_sql_query(query, self.connection)
+            # Execute query into Arrow-backed columns, skipping NumPy object boxing.
+            # One read, so dtypes are inferred over all rows: a column that is NULL
+            # throughout a chunk would otherwise come out of a concat as object dtype.
+            df = pd.read_sql_query(query, self.connection, dtype_backend="pyarrow")
             
             if df.empty:
                 return df, "Query executed successfully but returned no results."
             
             return df, ""
             
-        except sqlite3.Error as e:
-            return pd.DataFrame(), f"SQL Error: {str(e)}"
         except Exception as e:
-            return pd.DataFrame(), f"Unexpected error: {str(e)}"
+            # pandas re-raises driver errors, including authorizer denials, as its own
+            # DatabaseError chained to the original sqlite3 one
+            error = e.__cause__ if isinstance(e.__cause__, sqlite3.DatabaseError) else e
+            if not isinstance(error, sqlite3.Error):
+                return pd.DataFrame(), f"Unexpected error: {str(e)}"
+            if self._is_denied(error):
+                return pd.DataFrame(), f"Error: {self.NOT_AUTHORIZED_MESSAGE}"
+            return pd.DataFrame(), f"SQL Error: {str(error)}"
     
     def validate_query(self, query: str) -> Tuple[bool, str]:
         """
@@ -111,48 +236,59 @@ class DatabaseManager:
             Tuple of (is_valid, error_message)
         """
         try:
-            # Basic security checks
-            query_upper = query.strip().upper()
-            
-            forbidden_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'TRUNCATE']
-            for keyword in forbidden_keywords:
-                if keyword in query_upper:
-                    return False, f"Forbidden keyword '{keyword}' detected. Only SELECT queries are allowed."
-            
-            if not query_upper.startswith('SELECT'):
+            # Basic security check; the connection's authorizer rejects any write
+            # operation while the statement is compiled below
+            if not _classify_query(query).starts_with_select:
                 return False, "Query must start with SELECT."
             
             # Try to parse the query (without executing)
-            if not self.connection:
-                self.connect()
-            
-            cursor = self.connection.cursor()
-            cursor.execute(f"EXPLAIN QUERY PLAN {query}")
+            dry_run_error = self.dry_run(query)
+            if dry_run_error == self.NOT_AUTHORIZED_MESSAGE:
+                return False, dry_run_error
+            if dry_run_error:
+                return False, f"SQL syntax error: {dry_run_error}"
             
             return True, "Query is valid."
             
-        except sqlite3.Error as e:
-            return False, f"SQL syntax error: {str(e)}"
         except Exception as e:
             return False, f"Validation error: {str(e)}"
     
+    def dry_run(self, query: str) -> str:
+        """
+        Compile a query without running it; purely local and cheap.
+        
+        Args:
+            query: SQL query string
+            
+        Returns:
+            "" if SQLite can prepare the statement, otherwise the error message
+        """
+        try:
+            # EXPLAIN QUERY PLAN prepares the statement but never touches table data
+            self.connection.execute(f"EXPLAIN QUERY PLAN {query}")
+            return ""
+        except sqlite3.DatabaseError as e:
+            if self._is_denied(e):
+                return self.NOT_AUTHORIZED_MESSAGE
+            return str(e)
+    
+    @staticmethod
+    def _is_denied(error: sqlite3.Error) -> bool:
+        """Whether SQLite refused the statement because the authorizer denied it."""
+        # A denial while preparing surfaces as SQLITE_ERROR with this fixed message
+        return getattr(error, "sqlite_errorname", None) == "SQLITE_AUTH" or str(error) == "not authorized"
+    
     def get_table_names(self) -> List[str]:
         """Get list of all table names in the database."""
-        if not self.connection:
-            self.connect()
-        
         cursor = self.connection.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         return [row[0] for row in cursor.fetchall()]
     
     def get_column_names(self, table_name: str) -> List[str]:
         """Get column names for a specific table."""
-        if not self.connection:
-            self.connect()
-        
         cursor = self.connection.cursor()
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        return [row[1] for row in cursor.fetchall()]
+        cursor.execute("SELECT name FROM pragma_table_info(?)", (table_name,))
+        return [row[0] for row in cursor.fetchall()]
 
     def __enter__(self):
         """Context manager entry."""
@@ -1,21 +1,26 @@
-import openai
 import pandas as pd
-from typing import List
+from typing import Callable, List, Optional
 from config import OPENAI_API_KEY, MODEL_NAME, INSIGHT_PROMPT
+from llm_client import astream_completion, get_client
 
 class InsightGenerator:
     """Generates business insights from query results using AI."""
     
     def __init__(self):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY != "your-openai-api-key-here" else None
+        self.client = get_client() if OPENAI_API_KEY != "your-openai-api-key-here" else None
     
-    def generate_insights(self, query: str, df: pd.DataFrame) -> str:
+    async def agenerate_insights(self, query: str, df: pd.DataFrame, on_delta: Optional[Callable[[str], None]] = None, raise_errors: bool = False) -> str:
         """
         Generate business insights from SQL query results.
         
+        Async, so it can overlap other LLM calls.
+        
         Args:
             query: The SQL query that was executed
             df: DataFrame containing the query results
+            on_delta: Optional callback receiving each chunk of the insights as it streams in
+            raise_errors: Let API failures propagate instead of turning them into
+                fallback text, so a caller that memoizes the result never stores them
             
         Returns:
             AI-generated insights in plain English
@@ -27,30 +32,40 @@ class InsightGenerator:
             return "No data returned from the query. Consider adjusting your question or checking if the data exists."
         
         try:
-            # Prepare data summary for the AI
-            data_summary = self._prepare_data_summary(df)
-            
-            # Create the prompt
-            prompt = INSIGHT_PROMPT.format(
-                query=query,
-                results=data_summary
-            )
-            
-            # Call OpenAI API
-            response = self.client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a business analyst who provides actionable insights from data."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=400
-            )
-            
-            return response.choices[0].message.content.strip()
+            # Call OpenAI API, streaming so partial insights can be shown immediately
+            insights = await astream_completion(on_delta=on_delta, **self._insight_request(query, df))
+            return insights.strip()
             
         except Exception as e:
-            return f"Error generating AI insights: {str(e)}\n\n{self._generate_basic_insights(df)}"
+            if raise_errors:
+                raise
+            return self.fallback_insights(e, df)
+    
+    def fallback_insights(self, error: Exception, df: pd.DataFrame) -> str:
+        """Text shown when the LLM call fails: the error plus the locally computed insights."""
+        return f"Error generating AI insights: {str(error)}\n\n{self._generate_basic_insights(df)}"
+    
+    def _insight_request(self, query: str, df: pd.DataFrame) -> dict:
+        """Build the chat completion arguments for summarizing a result set."""
+        
+        # Prepare data summary for the AI
+        data_summary = self._prepare_data_summary(df)
+        
+        # Create the prompt
+        prompt = INSIGHT_PROMPT.format(
+            query=query,
+            results=data_summary
+        )
+        
+        return dict(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are a business analyst who provides actionable insights from data."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=400
+        )
     
     def _prepare_data_summary(self, df: pd.DataFrame) -> str:
         """Prepare a concise summary of the data for AI analysis."""
@@ -78,8 +93,10 @@ class InsightGenerator:
         numeric_cols = df.select_dtypes(include=['number']).columns
         if len(numeric_cols) > 0:
             summary_parts.append("\nNumeric column statistics:")
+            # One aggregation over all numeric columns instead of describe() per column
+            num_stats = df[numeric_cols].agg(['min', 'max', 'mean'])
             for col in numeric_cols:
-                stats = df[col].describe()
+                stats = num_stats[col]
                 summary_parts.append(f"{col}: min={stats['min']:.2f}, max={stats['max']:.2f}, mean={stats['mean']:.2f}")
         
         return "\n".join(summary_parts)
@@ -101,13 +118,10 @@ class InsightGenerator:
         
         # Analyze numeric columns
         numeric_cols = df.select_dtypes(include=['number']).columns
-        for col in numeric_cols:
-            col_data = df[col]
-            if not col_data.empty:
-                total = col_data.sum()
-                avg = col_data.mean()
-                max_val = col_data.max()
-                min_val = col_data.min()
+        if len(numeric_cols) > 0:
+            num_stats = df[numeric_cols].agg(['sum', 'mean', 'min', 'max'])
+            for col in numeric_cols:
+                total, avg, min_val, max_val = num_stats[col]
                 
                 insights.append(f"• **{col.replace('_', ' ').title()}**: Total = {total:,.2f}, Average = {avg:,.2f}")
                 
@@ -116,8 +130,9 @@ class InsightGenerator:
         
         # Analyze categorical columns
         text_cols = df.select_dtypes(include=['object', 'string']).columns
+        unique_counts = df[text_cols].nunique()
         for col in text_cols:
-            unique_count = df[col].nunique()
+            unique_count = unique_counts[col]
             if unique_count > 1:
                 insights.append(f"• **{col.replace('_', ' ').title()}**: {unique_count} unique values")
                 
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import threading
+import openai
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from config import OPENAI_API_KEY, OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT, OPENAI_MAX_RETRIES, LLM_CACHE_DIR, LLM_CACHE_TTL
+
+try:
+    import diskcache
+except ImportError:  # Optional: without it responses are only cached in memory
+    diskcache = None
+
+# HTTP/2 multiplexes concurrent requests over one connection; it needs h2 (in requirements.txt)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# One sync client for the whole process: it is thread-safe, so all sessions and
+# generators share its keep-alive connections instead of each opening their own
+_client: Optional[openai.OpenAI] = None
+_client_lock = threading.Lock()
+
+# httpx async pools are bound to the loop that first uses them, and every query runs
+# its own asyncio.run, so all async LLM calls go to one long-lived loop on a daemon
+# thread with a single AsyncOpenAI client; its connections outlive each query
+_llm_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_client: Optional[openai.AsyncOpenAI] = None
+_llm_loop_lock = threading.Lock()
+
+# One diskcache.Cache per process, opened on first use (False once opening has failed)
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+def client_options() -> Dict[str, Any]:
+    """
+    Constructor arguments shared by every OpenAI client.
+    
+    The SDK's own retry loop backs off exponentially (honouring Retry-After)
+    on rate limits, timeouts, connection errors and 5xx responses, and the
+    timeout caps how long a stalled request can hold up the app.
+    """
+    return dict(
+        api_key=OPENAI_API_KEY,
+        timeout=openai.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        max_retries=OPENAI_MAX_RETRIES
+    )
+
+def get_client() -> openai.OpenAI:
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # The SDK's default pool limits (DEFAULT_CONNECTION_LIMITS) are kept
+            _client = openai.OpenAI(http_client=openai.DefaultHttpxClient(http2=HTTP2_AVAILABLE), **client_options())
+    return _client
+
+def _get_llm_loop() -> Tuple[asyncio.AbstractEventLoop, openai.AsyncOpenAI]:
+    """Return the shared LLM event loop and its AsyncOpenAI client, starting them on first use."""
+    global _llm_loop, _async_client
+    with _llm_loop_lock:
+        if _llm_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+            _async_client = openai.AsyncOpenAI(
+                http_client=openai.DefaultAsyncHttpxClient(http2=HTTP2_AVAILABLE), **client_options()
+            )
+            _llm_loop = loop
+    return _llm_loop, _async_client
+
+async def _on_llm_loop(call: Callable[[openai.AsyncOpenAI], Awaitable[Any]]) -> Any:
+    """Run call(shared client) on the LLM loop and await its result from the caller's own loop."""
+    loop, client = _get_llm_loop()
+    # Cancelling the awaiting task cancels the request on the LLM loop too
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(client), loop))
+
+def _get_disk_cache():
+    """Return the shared on-disk cache, or None if diskcache is missing, disabled or unusable."""
+    global _disk_cache
+    if diskcache is None or not LLM_CACHE_DIR:
+        return None
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            try:
+                # Private to the user; see LLM_CACHE_DIR
+                os.makedirs(LLM_CACHE_DIR, mode=0o700, exist_ok=True)
+                # Entries are tagged with their namespace; the index keeps clear() cheap
+                _disk_cache = diskcache.Cache(LLM_CACHE_DIR, tag_index=True)
+            except OSError:
+                _disk_cache = False
+    # An empty diskcache.Cache is falsy, so compare against the sentinel explicitly
+    return None if _disk_cache is False else _disk_cache
+
+class ResponseCache:
+    """
+    Thread-safe LRU map for LLM responses, shared by every session in the process.
+    
+    With a namespace (and diskcache installed), entries are also written to
+    LLM_CACHE_DIR so they survive restarts and are shared between replicas.
+    The namespace should fingerprint whatever shapes the response (model,
+    temperature, prompt), since persisted entries outlive config changes.
+    """
+    
+    def __init__(self, maxsize: int = 512, namespace: Optional[str] = None):
+        self.maxsize = maxsize
+        self.namespace = namespace
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[str]:
+        """Return the cached response for key, or None on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        
+        disk = self._disk()
+        value = disk.get(self._disk_key(key)) if disk is not None else None
+        if value is not None:
+            self._remember(key, value)
+        return value
+    
+    def put(self, key: Hashable, value: str):
+        """Store a response, evicting the least recently used entry when full."""
+        self._remember(key, value)
+        disk = self._disk()
+        if disk is not None:
+            disk.set(self._disk_key(key), value, expire=LLM_CACHE_TTL, tag=self.namespace)
+    
+    def clear(self):
+        """Drop every response, including this namespace's persisted entries."""
+        with self._lock:
+            self._entries.clear()
+        disk = self._disk()
+        if disk is not None:
+            disk.evict(self.namespace)
+    
+    def _remember(self, key: Hashable, value: str):
+        """Insert into the in-memory LRU."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def _disk(self):
+        """The on-disk cache, if this cache persists at all."""
+        return _get_disk_cache() if self.namespace else None
+    
+    def _disk_key(self, key: Hashable) -> str:
+        """Fixed-size key for the on-disk cache."""
+        return hashlib.sha1(f"{self.namespace}|{key!r}".encode()).hexdigest()
+
+def partial_json_string(text: str, key: str) -> str:
+    """
+    Best-effort value of a string field in a JSON object that is still streaming in.
+    
+    Args:
+        text: The JSON received so far
+        key: Name of the string field to extract
+        
+    Returns:
+        The field's (possibly incomplete) value, or "" if it hasn't started yet
+    """
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % re.escape(key), text)
+    if not match:
+        return ""
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except ValueError:
+        # A half-received escape such as \u00; show it raw until the rest arrives
+        return match.group(1)
+
+def stream_completion(client: Any, on_delta: Optional[Callable[[str], None]] = None, **request: Any) -> str:
+    """
+    Run a streamed chat completion and return the full response text.
+    
+    Args:
+        client: OpenAI client to issue the request with
+        on_delta: Optional callback receiving each text chunk as it arrives
+        **request: Arguments for chat.completions.create
+        
+    Returns:
+        The complete response content
+    """
+    content = ""
+    for chunk in client.chat.completions.create(stream=True, **request):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            content += delta
+            if on_delta:
+                on_delta(delta)
+    return content
+
+async def astream_completion(on_delta: Optional[Callable[[str], None]] = None, **request: Any) -> str:
+    """
+    Async counterpart of stream_completion on the shared AsyncOpenAI client.
+    
+    Awaitable from any event loop; on_delta is called on the LLM loop's thread,
+    so it must only do thread-safe work such as appending to a buffer.
+    """
+    return await _on_llm_loop(lambda client: _astream(client, on_delta, request))
+
+async def acreate_completion(**request: Any) -> Any:
+    """Non-streamed chat completion on the shared AsyncOpenAI client; awaitable from any event loop."""
+    return await _on_llm_loop(lambda client: client.chat.completions.create(**request))
+
+async def _astream(client: openai.AsyncOpenAI, on_delta: Optional[Callable[[str], None]], request: Dict[str, Any]) -> str:
+    """Stream one completion on client, collecting the text."""
+    content = ""
+    async for chunk in await client.chat.completions.create(stream=True, **request):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            content += delta
+            if on_delta:
+                on_delta(delta)
+    return content
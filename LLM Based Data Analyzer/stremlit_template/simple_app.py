@@ -7,6 +7,7 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
+from typing import Tuple
 
 # Set page config first
 st.set_page_config(
@@ -15,6 +16,18 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """Shared DatabaseManager, so clicks reuse one connection instead of reconnecting."""
+    from database_manager import DatabaseManager
+    # The connection is opened with check_same_thread=False, so all sessions can share it
+    return DatabaseManager()
+
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def run_query(sql: str, db_mtime: float) -> Tuple[pd.DataFrame, str]:
+    """Execute a query once per (SQL string, database mtime); repeat clicks are served from the cache."""
+    return get_db().execute_query(sql)
+
 def main():
     """Simple main function to test basic functionality."""
     
@@ -33,17 +46,16 @@ def main():
             st.success(f"✓ Database file exists: {DATABASE_PATH}")
             
             # Test database connection
-            db = DatabaseManager()
-            with db:
-                tables = db.get_table_names()
-                st.success(f"✓ Database connected. Tables: {tables}")
-                
-                # Test simple query
-                df, error = db.execute_query("SELECT COUNT(*) as count FROM customers")
-                if error:
-                    st.error(f"Query error: {error}")
-                else:
-                    st.success(f"✓ Query successful. Customer count: {df.iloc[0]['count']}")
+            db = get_db()
+            tables = db.get_table_names()
+            st.success(f"✓ Database connected. Tables: {tables}")
+            
+            # Test simple query
+            df, error = run_query("SELECT COUNT(*) as count FROM customers", os.path.getmtime(DATABASE_PATH))
+            if error:
+                st.error(f"Query error: {error}")
+            else:
+                st.success(f"✓ Query successful. Customer count: {df.iloc[0]['count']}")
         else:
             st.error(f"✗ Database file not found: {DATABASE_PATH}")
         
@@ -57,14 +69,14 @@ def main():
         query = st.text_input("Enter a simple SQL query:", "SELECT * FROM customers LIMIT 5")
         
         if st.button("Execute Query"):
-            db = DatabaseManager()
-            with db:
-                df, error = db.execute_query(query)
-                if error:
-                    st.error(f"Error: {error}")
-                else:
-                    st.success("Query executed successfully!")
-                    st.dataframe(df)
+            # The mtime is part of the key, so rewriting the database invalidates cached results
+            db_mtime = os.path.getmtime(DATABASE_PATH) if os.path.exists(DATABASE_PATH) else 0.0
+            df, error = run_query(query, db_mtime)
+            if error:
+                st.error(f"Error: {error}")
+            else:
+                st.success("Query executed successfully!")
+                st.dataframe(df)
         
     except Exception as e:
         st.error(f"Error: {str(e)}")
@@ -1,63 +1,135 @@
-import openai
-from typing import Tuple, Optional
-from config import OPENAI_API_KEY, MODEL_NAME, TEMPERATURE, SYSTEM_PROMPT
-from database_manager import DatabaseManager
+import hashlib
+import json
+import re
+import time
+from typing import Callable, Tuple, Optional
+from config import OPENAI_API_KEY, MODEL_NAME, EXPLAIN_MODEL_NAME, TEMPERATURE, SYSTEM_PROMPT, SQL_AND_EXPLANATION_PROMPT, SCHEMA_CACHE_TTL, MAX_QUERY_RESULTS
+from database_manager import DatabaseManager, _classify_query, _strip_statement_end
+from llm_client import ResponseCache, acreate_completion, astream_completion, get_client, stream_completion
+
+# Opening ```/```sql fence and closing ``` fence around a model answer
+_FENCE_RE = re.compile(r'^```(?:sql)?\s*|\s*```$', re.IGNORECASE)
+# Whole-table reads the model sometimes emits for "show me ..." questions
+_SELECT_STAR_RE = re.compile(r'^\s*SELECT\s+\*\s+FROM\b', re.IGNORECASE)
+
+# Phrasings common enough to answer without the LLM; table and column words are
+# resolved against the live schema, and anything that does not resolve falls through.
+# Only a closed list of filler words may follow the table name: any other qualifier
+# ("are from California", "were shipped in 2024") is a filter the template can't express.
+_COUNT_TEMPLATE_RE = re.compile(r'^\s*(?:how many|count(?: of)?(?: the)?|number of)\s+(\w+)(?:\s+(?:do\s+we\s+have|are\s+there))?\s*\??\s*$', re.IGNORECASE)
+_TOP_N_TEMPLATE_RE = re.compile(r'^\s*(?:show(?: me)?\s+)?(?:the\s+)?top\s+(\d+)\s+(\w+)\s+by\s+(\w+(?:\s+\w+)?)\s*\??\s*$', re.IGNORECASE)
+_LIST_TEMPLATE_RE = re.compile(r'^\s*(?:show|list)(?: me)?(?: all)?(?: the)?\s+(\w+)\s*\??\s*$', re.IGNORECASE)
+
+# Shared by every missing-key message so the sync and async variants stay in step
+_NO_API_KEY_ERROR = "OpenAI API key not configured."
 
 class SQLGenerator:
     """Generates SQL queries from natural language using OpenAI GPT."""
     
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY != "your-openai-api-key-here" else None
-        self.db_manager = DatabaseManager()
-        
-    def generate_sql(self, natural_language_query: str) -> Tuple[str, str]:
+    def __init__(self, db_manager: Optional[DatabaseManager] = None, schema_info: Optional[str] = None):
+        self.client = get_client() if OPENAI_API_KEY != "your-openai-api-key-here" else None
+        self.db_manager = db_manager or DatabaseManager()
+        # A precomputed schema_info is used for every prompt and never re-read
+        self._schema_pinned = schema_info is not None
+        self._schema_cache: Optional[str] = schema_info
+        self._schema_ts = 0.0
+    
+    def _get_schema(self) -> str:
+        """Schema text for prompts, re-read from the database at most every SCHEMA_CACHE_TTL seconds unless pinned."""
+        if self._schema_pinned:
+            return self._schema_cache
+        now = time.monotonic()
+        if self._schema_cache is None or now - self._schema_ts >= SCHEMA_CACHE_TTL:
+            self._schema_cache = self.db_manager.get_schema_info()
+            self._schema_ts = now
+        return self._schema_cache
+    
+    def generate_sql_and_explanation(self, natural_language_query: str, validate: bool = True, on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str, str]:
         """
-        Convert natural language query to SQL.
+        Convert natural language query to SQL and explain it with a single LLM call.
         
         Args:
             natural_language_query: User's question in natural language
+            validate: Check the SQL with EXPLAIN QUERY PLAN; callers that
+                execute the query straight away can skip this
+            on_delta: Optional callback receiving the raw JSON as it streams in
+                (see llm_client.partial_json_string); not called on a cache hit
             
         Returns:
-            Tuple of (generated_sql, error_message)
+            Tuple of (generated_sql, explanation, error_message)
         """
-        if not self.client:
-            return "", "Error: OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."
+        shortcut = self._answer_without_llm(natural_language_query)
+        if shortcut:
+            return shortcut
         
         try:
-            # Get database schema for context
-            schema_info = self.db_manager.get_schema_info()
+            cache_key, answer, request = self._lookup_sql_and_explanation(natural_language_query)
+            if answer is None:
+                # The schema prompt is sent once for both answers; the JSON is only parsed once the stream completes
+                answer = self._store_sql_and_explanation(cache_key, stream_completion(self.client, on_delta, **request))
+            return self._checked_answer(*answer, validate)
             
-            # Prepare the prompt
-            system_message = SYSTEM_PROMPT.format(schema_info=schema_info)
-            
-            # Call OpenAI API
-            response = self.client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": natural_language_query}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=500
-            )
-            
-            generated_sql = response.choices[0].message.content.strip()
-            
-            # Clean up the SQL (remove markdown formatting if present)
-            if generated_sql.startswith('```sql'):
-                generated_sql = generated_sql.replace('```sql', '').replace('```', '').strip()
-            elif generated_sql.startswith('```'):
-                generated_sql = generated_sql.replace('```', '').strip()
-            
-            # Validate the generated SQL
-            is_valid, validation_error = self.db_manager.validate_query(generated_sql)
-            if not is_valid:
-                return "", f"Generated SQL validation failed: {validation_error}"
-            
-            return generated_sql, ""
+        except Exception as e:
+            return "", "", f"Error generating SQL: {str(e)}"
+    
+    async def agenerate_sql_and_explanation(self, natural_language_query: str, validate: bool = True, on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str, str]:
+        """Async variant of generate_sql_and_explanation; only the completion call differs."""
+        shortcut = self._answer_without_llm(natural_language_query)
+        if shortcut:
+            return shortcut
+        
+        try:
+            cache_key, answer, request = self._lookup_sql_and_explanation(natural_language_query)
+            if answer is None:
+                answer = self._store_sql_and_explanation(cache_key, await astream_completion(on_delta, **request))
+            return self._checked_answer(*answer, validate)
             
         except Exception as e:
-            return "", f"Error generating SQL: {str(e)}"
+            return "", "", f"Error generating SQL: {str(e)}"
+    
+    def generate_and_validate(self, natural_language_query: str, on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str, str]:
+        """
+        Generate SQL, check it locally, and spend at most one corrective LLM call on it.
+        
+        Args:
+            natural_language_query: User's question in natural language
+            on_delta: Optional callback receiving the first answer's raw JSON as it streams in
+            
+        Returns:
+            Tuple of (sql, explanation, error_message). sql is "" if generation
+            failed; otherwise it may come with an error if even the corrected
+            query does not compile. explanation is "" when the SQL was corrected,
+            since the first answer's explanation no longer applies, or when a
+            cached correction has no explanation yet.
+        """
+        generated_sql, explanation, error = self.generate_sql_and_explanation(natural_language_query, validate=False, on_delta=on_delta)
+        if error:
+            return "", "", error
+        
+        is_valid, validation_error = self.db_manager.validate_query(generated_sql)
+        if is_valid:
+            return generated_sql, explanation, ""
+        
+        # Reuses the pinned/cached schema, so the retry costs only the API call
+        improved_sql, improve_error = self.improve_query(generated_sql, validation_error, natural_language_query)
+        if improve_error:
+            return generated_sql, "", validation_error
+        
+        is_valid, validation_error = self.db_manager.validate_query(improved_sql)
+        if not is_valid:
+            return improved_sql, "", validation_error
+        
+        self.remember_sql(natural_language_query, improved_sql)
+        return improved_sql, "", ""
+    
+    def remember_sql(self, natural_language_query: str, sql_query: str):
+        """
+        Cache working SQL for a question, e.g. once a corrected query has run.
+        
+        The corrected query replaces the answer that failed, so asking again
+        neither repeats the broken SQL nor pays for another correction.
+        """
+        _sql_cache.put(self._sql_cache_key(natural_language_query, self._get_schema()), sql_query)
     
     def improve_query(self, original_query: str, error_message: str, natural_language_query: str) -> Tuple[str, str]:
         """
@@ -72,80 +144,287 @@ class SQLGenerator:
             Tuple of (improved_sql, error_message)
         """
         if not self.client:
-            return "", "Error: OpenAI API key not configured."
+            return "", f"Error: {_NO_API_KEY_ERROR}"
         
         try:
-            schema_info = self.db_manager.get_schema_info()
-            
-            improvement_prompt = f"""
-            The following SQL query failed with an error. Please fix it.
-            
-            Original question: {natural_language_query}
-            Failed SQL: {original_query}
-            Error: {error_message}
-            
-            Database Schema:
-            {schema_info}
+            response = self.client.chat.completions.create(**self._improvement_request(original_query, error_message, natural_language_query))
+            return self._clean_sql(response.choices[0].message.content), ""
             
-            Generate a corrected SQL query that addresses the error:
-            """
-            
-            response = self.client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are an expert SQL developer. Fix the provided SQL query based on the error message."},
-                    {"role": "user", "content": improvement_prompt}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=500
-            )
-            
-            improved_sql = response.choices[0].message.content.strip()
-            
-            # Clean up the SQL
-            if improved_sql.startswith('```sql'):
-                improved_sql = improved_sql.replace('```sql', '').replace('```', '').strip()
-            elif improved_sql.startswith('```'):
-                improved_sql = improved_sql.replace('```', '').strip()
-            
-            return improved_sql, ""
+        except Exception as e:
+            return "", f"Error improving query: {str(e)}"
+    
+    async def aimprove_query(self, original_query: str, error_message: str, natural_language_query: str) -> Tuple[str, str]:
+        """Async variant of improve_query; only the completion call differs."""
+        if not self.client:
+            return "", f"Error: {_NO_API_KEY_ERROR}"
+        
+        try:
+            response = await acreate_completion(**self._improvement_request(original_query, error_message, natural_language_query))
+            return self._clean_sql(response.choices[0].message.content), ""
             
         except Exception as e:
             return "", f"Error improving query: {str(e)}"
 
-    def explain_query(self, sql_query: str) -> str:
+    def explain_query(self, sql_query: str, on_delta: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate a human-readable explanation of what the SQL query does.
         
         Args:
             sql_query: SQL query to explain
+            on_delta: Optional callback receiving each text chunk as it arrives;
+                not called on a cache hit
             
         Returns:
             Plain English explanation of the query
         """
-        if not self.client:
-            return "Cannot explain query: OpenAI API key not configured."
+        explanation = self._lookup_explanation(sql_query)
+        if explanation is not None:
+            return explanation
         
         try:
-            explanation_prompt = f"""
-            Explain what this SQL query does in simple, business-friendly language:
+            return self._store_explanation(sql_query, stream_completion(self.client, on_delta, **self._explanation_request(sql_query)))
             
-            {sql_query}
+        except Exception as e:
+            return f"Error explaining query: {str(e)}"
+    
+    async def aexplain_query(self, sql_query: str, on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """Async variant of explain_query, so it can overlap other LLM calls; only the completion call differs."""
+        explanation = self._lookup_explanation(sql_query)
+        if explanation is not None:
+            return explanation
+        
+        try:
+            return self._store_explanation(sql_query, await astream_completion(on_delta, **self._explanation_request(sql_query)))
+            
+        except Exception as e:
+            return f"Error explaining query: {str(e)}"
+    
+    def _answer_without_llm(self, natural_language_query: str) -> Optional[Tuple[str, str, str]]:
+        """(sql, explanation, error) when no API call is needed or possible: a template match, or no API key."""
+        template = self._match_template(natural_language_query)
+        if template:
+            return template[0], template[1], ""
+        if not self.client:
+            return "", "", f"Error: {_NO_API_KEY_ERROR} Please set OPENAI_API_KEY environment variable."
+        return None
+    
+    def _lookup_sql_and_explanation(self, natural_language_query: str) -> Tuple[Tuple[str, str], Optional[Tuple[str, str]], dict]:
+        """
+        (cache_key, cached (sql, explanation) or None, completion request) for a question.
+        
+        The explanation is "" when the cached SQL is a correction nobody has explained yet.
+        """
+        schema_info = self._get_schema()
+        cache_key = self._sql_cache_key(natural_language_query, schema_info)
+        generated_sql = _sql_cache.get(cache_key)
+        answer = (generated_sql, _explanation_cache.get(generated_sql) or "") if generated_sql is not None else None
+        return cache_key, answer, self._sql_and_explanation_request(natural_language_query, schema_info)
+    
+    def _checked_answer(self, generated_sql: str, explanation: str, validate: bool) -> Tuple[str, str, str]:
+        """(sql, explanation, error) after the optional validation step."""
+        validation_error = self._validation_error(generated_sql, validate)
+        return ("", "", validation_error) if validation_error else (generated_sql, explanation, "")
+    
+    def _lookup_explanation(self, sql_query: str) -> Optional[str]:
+        """The cached explanation, the missing-key message, or None if the LLM has to be asked."""
+        if not self.client:
+            return f"Cannot explain query: {_NO_API_KEY_ERROR}"
+        return _explanation_cache.get(sql_query)
+    
+    @staticmethod
+    def _store_explanation(sql_query: str, content: str) -> str:
+        """Clean up and cache a streamed explanation."""
+        explanation = content.strip()
+        _explanation_cache.put(sql_query, explanation)
+        return explanation
+    
+    def _validation_error(self, generated_sql: str, validate: bool) -> str:
+        """Validate the generated SQL when asked; returns an error message, or "" if it passed."""
+        if validate:
+            is_valid, validation_error = self.db_manager.validate_query(generated_sql)
+            if not is_valid:
+                return f"Generated SQL validation failed: {validation_error}"
+        return ""
+    
+    @staticmethod
+    def _sql_cache_key(natural_language_query: str, schema_info: str) -> Tuple[str, str]:
+        """Key generated SQL on the question and a schema fingerprint, so schema changes invalidate it."""
+        return natural_language_query, hashlib.md5(schema_info.encode()).hexdigest()
+    
+    @staticmethod
+    def _clean_sql(generated_sql: str) -> str:
+        """Clean up the SQL (remove markdown formatting if present) and cap unbounded SELECT * reads."""
+        generated_sql = _FENCE_RE.sub('', generated_sql.strip()).strip()
+        # Written into the SQL itself, so the cap also holds when the user copies it from
+        # SQL-only mode; after any trailing comment and semicolon, so it stays one statement
+        if _SELECT_STAR_RE.match(generated_sql) and not _classify_query(generated_sql).has_limit:
+            generated_sql = f"{_strip_statement_end(generated_sql)}\nLIMIT {MAX_QUERY_RESULTS}"
+        return generated_sql
+    
+    def _match_template(self, natural_language_query: str) -> Optional[Tuple[str, str]]:
+        """
+        Answer common question shapes locally, with no API call.
+        
+        Args:
+            natural_language_query: User's question in natural language
             
-            Provide a clear, concise explanation that a non-technical person would understand.
-            """
+        Returns:
+            Tuple of (sql, explanation), or None to fall back to the LLM
+        """
+        try:
+            count_match = _COUNT_TEMPLATE_RE.match(natural_language_query)
+            top_n_match = _TOP_N_TEMPLATE_RE.match(natural_language_query)
+            list_match = _LIST_TEMPLATE_RE.match(natural_language_query)
             
-            response = self.client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a data analyst who explains SQL queries in simple business terms."},
-                    {"role": "user", "content": explanation_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=200
-            )
+            if count_match:
+                table = self._template_table(count_match.group(1))
+                if table is None:
+                    return None
+                sql = f"SELECT COUNT(*) AS count FROM {DatabaseManager.quote_identifier(table)}"
+                explanation = f"Counts the rows in the {table} table."
+            elif top_n_match:
+                limit = min(int(top_n_match.group(1)), MAX_QUERY_RESULTS)
+                table = self._template_table(top_n_match.group(2))
+                if table is None:
+                    return None
+                wanted = "_".join(top_n_match.group(3).lower().split())
+                column = next((col for col in self.db_manager.get_column_names(table) if col.lower() == wanted), None)
+                if column is None:
+                    return None
+                sql = (f"SELECT * FROM {DatabaseManager.quote_identifier(table)} "
+                       f"ORDER BY {DatabaseManager.quote_identifier(column)} DESC LIMIT {limit}")
+                explanation = f"Lists the {limit} {table} with the highest {column}."
+            elif list_match:
+                table = self._template_table(list_match.group(1))
+                if table is None:
+                    return None
+                sql = f"SELECT * FROM {DatabaseManager.quote_identifier(table)} LIMIT {MAX_QUERY_RESULTS}"
+                explanation = f"Shows the first {MAX_QUERY_RESULTS} rows of the {table} table."
+            else:
+                return None
             
-            return response.choices[0].message.content.strip()
+            # Template SQL is always checked, whatever the caller asked for
+            is_valid, _ = self.db_manager.validate_query(sql)
+            return (sql, explanation) if is_valid else None
             
-        except Exception as e:
-            return f"Error explaining query: {str(e)}"
\ No newline at end of file
+        except Exception:
+            return None
+    
+    def _template_table(self, word: str) -> Optional[str]:
+        """Resolve a word from the question to a table name, allowing singular/plural forms."""
+        word = word.lower()
+        candidates = {word, word + "s", word.rstrip("s")}
+        return next((table for table in self.db_manager.get_table_names() if table.lower() in candidates), None)
+    
+    def _store_sql_and_explanation(self, cache_key: Tuple[str, str], content: str) -> Tuple[str, str]:
+        """Parse a JSON-mode answer into (sql, explanation), caching both if the SQL validates."""
+        answer = json.loads(content)
+        generated_sql = self._clean_sql(str(answer["sql"]))
+        explanation = str(answer.get("explanation", "")).strip()
+        
+        # SQL that fails validation is not cached: it would be served, and
+        # corrected again, on every repeat; remember_sql stores the fix instead
+        is_valid, _ = self.db_manager.validate_query(generated_sql)
+        if is_valid:
+            _sql_cache.put(cache_key, generated_sql)
+            _explanation_cache.put(generated_sql, explanation)
+        return generated_sql, explanation
+    
+    @staticmethod
+    def _sql_request(natural_language_query: str, schema_info: str) -> dict:
+        """Build the chat completion arguments for generating SQL."""
+        return dict(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT.format(schema_info=schema_info)},
+                {"role": "user", "content": natural_language_query}
+            ],
+            temperature=TEMPERATURE,
+            # A single SELECT rarely needs more; stop before any trailing commentary
+            max_tokens=250,
+            stop=[";\n\n"]
+        )
+    
+    @staticmethod
+    def _sql_and_explanation_request(natural_language_query: str, schema_info: str) -> dict:
+        """Build the JSON-mode chat completion arguments for generating SQL with its explanation."""
+        return dict(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": SQL_AND_EXPLANATION_PROMPT.format(schema_info=schema_info)},
+                {"role": "user", "content": natural_language_query}
+            ],
+            temperature=TEMPERATURE,
+            # Room for a 250-token query plus a three-sentence explanation; the
+            # plain-text stop sequences don't apply inside JSON strings
+            max_tokens=400,
+            response_format={"type": "json_object"}
+        )
+    
+    def _improvement_request(self, original_query: str, error_message: str, natural_language_query: str) -> dict:
+        """Build the chat completion arguments for fixing a failed query."""
+        schema_info = self._get_schema()
+        
+        improvement_prompt = f"""
+        The following SQL query failed with an error. Please fix it.
+        
+        Original question: {natural_language_query}
+        Failed SQL: {original_query}
+        Error: {error_message}
+        
+        Database Schema:
+        {schema_info}
+        
+        Generate a corrected SQL query that addresses the error:
+        """
+        
+        return dict(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are an expert SQL developer. Fix the provided SQL query based on the error message."},
+                {"role": "user", "content": improvement_prompt}
+            ],
+            temperature=TEMPERATURE,
+            max_tokens=500
+        )
+    
+    @staticmethod
+    def _explanation_request(sql_query: str) -> dict:
+        """Build the chat completion arguments for explaining a query."""
+        explanation_prompt = f"""
+        Explain what this SQL query does in simple, business-friendly language:
+        
+        {sql_query}
+        
+        Provide a clear, concise explanation in at most 3 sentences that a non-technical person would understand.
+        """
+        
+        return dict(
+            model=EXPLAIN_MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are a data analyst who explains SQL queries in simple business terms."},
+                {"role": "user", "content": explanation_prompt}
+            ],
+            temperature=0.3,
+            max_tokens=120,
+            stop=["\n\n"]
+        )
+
+def _request_fingerprint(*requests: dict) -> str:
+    """Hash of every parameter of the given completion requests (model, prompts, temperature, limits, stop)."""
+    return hashlib.md5(json.dumps(requests, sort_keys=True).encode()).hexdigest()
+
+# Generated SQL keyed on (question, schema fingerprint) and explanations keyed
+# on the SQL text. Only successful responses and SQL that compiles are stored,
+# so errors are retried.
+# Both are persisted across restarts. Each namespace fingerprints every request
+# that writes to the cache, built with placeholder inputs (the inputs themselves
+# are in the keys), so editing a prompt or setting never serves stale answers.
+_sql_cache = ResponseCache(maxsize=512, namespace="sql|" + _request_fingerprint(
+    SQLGenerator._sql_request("{question}", "{schema}"),
+    SQLGenerator._sql_and_explanation_request("{question}", "{schema}")
+))
+_explanation_cache = ResponseCache(maxsize=512, namespace="explanation|" + _request_fingerprint(
+    SQLGenerator._sql_and_explanation_request("{question}", "{schema}"),
+    SQLGenerator._explanation_request("{sql}")
+))
\ No newline at end of file
@@ -81,6 +81,219 @@ def test_sql_generator():
         traceback.print_exc()
         return False
 
+def _make_test_db():
+    """Create a small throwaway database and return its path."""
+    import os
+    import sqlite3
+    import tempfile
+    
+    path = os.path.join(tempfile.mkdtemp(), "test.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, name TEXT, city TEXT);
+        CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer_id INTEGER, total_amount REAL);
+    """)
+    conn.executemany("INSERT INTO customers VALUES (?, ?, ?)", [(i, f"Customer {i}", "NY") for i in range(1, 301)])
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", [(i, i, 10.0 * i) for i in range(1, 21)])
+    conn.commit()
+    conn.close()
+    return path
+
+def test_authorizer():
+    """The SQLite authorizer only lets read-only statements compile."""
+    import sqlite3
+    from database_manager import DatabaseManager
+    
+    authorize = DatabaseManager._authorize
+    for action in DatabaseManager.READ_ONLY_ACTIONS:
+        assert authorize(action, None, None, None, None) == sqlite3.SQLITE_OK
+    for action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_ATTACH):
+        assert authorize(action, None, None, None, None) == sqlite3.SQLITE_DENY
+    assert authorize(sqlite3.SQLITE_PRAGMA, "table_info", None, None, None) == sqlite3.SQLITE_OK
+    assert authorize(sqlite3.SQLITE_PRAGMA, "journal_mode", None, None, None) == sqlite3.SQLITE_DENY
+    # Registering the pragma_table_info virtual table reports an UPDATE of sqlite_master only
+    assert authorize(sqlite3.SQLITE_UPDATE, "sqlite_master", "sql", "main", None) == sqlite3.SQLITE_OK
+    assert authorize(sqlite3.SQLITE_UPDATE, "customers", "name", "main", None) == sqlite3.SQLITE_DENY
+    
+    db = DatabaseManager(_make_test_db())
+    for statement in ("ATTACH DATABASE 'other.db' AS other", "DELETE FROM customers", "SELECT load_extension('x')"):
+        try:
+            db.connection.execute(statement)
+        except sqlite3.DatabaseError as e:
+            assert DatabaseManager._is_denied(e), statement
+        else:
+            raise AssertionError(f"{statement!r} was allowed")
+    
+    # The schema helpers go through pragma_table_info and must still work
+    assert "customers" in db.get_schema_info() and "total_amount" in db.get_schema_info()
+    assert db.get_column_names("orders") == ["order_id", "customer_id", "total_amount"]
+    
+    df, error = db.execute_query("SELECT load_extension('x')")
+    assert df.empty and error == f"Error: {DatabaseManager.NOT_AUTHORIZED_MESSAGE}"
+    df, error = db.execute_query("SELECT nope FROM customers")
+    assert df.empty and error == "SQL Error: no such column: nope"
+    db.disconnect()
+
+def test_dry_run_and_validate_query():
+    """Queries are checked locally with EXPLAIN QUERY PLAN, without touching table data."""
+    from database_manager import DatabaseManager
+    
+    db = DatabaseManager(_make_test_db())
+    assert db.dry_run("SELECT * FROM customers") == ""
+    assert db.dry_run("SELECT nope FROM customers") == "no such column: nope"
+    # Writes are refused by the authorizer while the statement is prepared
+    for statement in ("DELETE FROM customers", "WITH x AS (SELECT 1) DELETE FROM customers", "ATTACH DATABASE 'other.db' AS other"):
+        assert db.dry_run(statement) == DatabaseManager.NOT_AUTHORIZED_MESSAGE, statement
+    
+    assert db.validate_query("SELECT city, COUNT(*) FROM customers GROUP BY city") == (True, "Query is valid.")
+    assert db.validate_query("DELETE FROM customers") == (False, "Query must start with SELECT.")
+    assert db.validate_query("SELECT * FROM missing") == (False, "SQL syntax error: no such table: missing")
+    
+    # Table-valued pragmas are only authorized when they run, so execution is the backstop
+    df, error = db.execute_query("SELECT * FROM pragma_journal_mode")
+    assert df.empty and error == f"Error: {DatabaseManager.NOT_AUTHORIZED_MESSAGE}"
+    db.disconnect()
+
+def test_partial_json_string():
+    """Streaming JSON fields are extracted even before the object is complete."""
+    from llm_client import partial_json_string
+    
+    assert partial_json_string("", "sql") == ""
+    assert partial_json_string('{"sq', "sql") == ""
+    assert partial_json_string('{"sql": "SELECT ci', "sql") == "SELECT ci"
+    assert partial_json_string('{"sql": "SELECT \\"a\\" FROM t", "expl', "sql") == 'SELECT "a" FROM t'
+    assert partial_json_string('{"sql": "a\\nb', "sql") == "a\nb"
+    # A half-received escape is shown raw until the rest arrives
+    assert partial_json_string('{"sql": "caf\\u00', "sql") == "caf\\u00"
+    assert partial_json_string('{"explanation": "e", "sql": "S"}', "sql") == "S"
+    assert partial_json_string('{"sql": "S", "explanation": "Counts', "explanation") == "Counts"
+
+def test_response_cache():
+    """ResponseCache is an LRU in memory, optionally persisted on disk."""
+    import tempfile
+    import llm_client
+    from llm_client import ResponseCache
+    
+    cache = ResponseCache(maxsize=2)
+    assert cache.get("a") is None
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"  # Refreshes "a", so "b" is now least recently used
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1" and cache.get("c") == "3"
+    cache.clear()
+    assert cache.get("a") is None
+    
+    if llm_client.diskcache is None:
+        return
+    saved = llm_client._disk_cache
+    llm_client._disk_cache = llm_client.diskcache.Cache(tempfile.mkdtemp(), tag_index=True)
+    try:
+        ResponseCache(maxsize=2, namespace="test|v1").put(("q", "h"), "SELECT 1")
+        ResponseCache(maxsize=2, namespace="test|v2").put(("q", "h"), "SELECT 2")
+        # A fresh instance (as after a restart) reads it back; other namespaces don't see it
+        assert ResponseCache(maxsize=2, namespace="test|v1").get(("q", "h")) == "SELECT 1"
+        assert ResponseCache(maxsize=2, namespace="test|v3").get(("q", "h")) is None
+        assert ResponseCache(maxsize=2).get(("q", "h")) is None
+        # Clearing removes the namespace's persisted entries, and only those
+        ResponseCache(maxsize=2, namespace="test|v1").clear()
+        assert ResponseCache(maxsize=2, namespace="test|v1").get(("q", "h")) is None
+        assert ResponseCache(maxsize=2, namespace="test|v2").get(("q", "h")) == "SELECT 2"
+    finally:
+        llm_client._disk_cache.close()
+        llm_client._disk_cache = saved
+
+def test_result_row_cap():
+    """Unbounded queries are capped even when they end in a comment that mentions LIMIT."""
+    import pandas as pd
+    from config import MAX_QUERY_RESULTS
+    from database_manager import DatabaseManager
+    from sql_generator import SQLGenerator
+    
+    db = DatabaseManager(_make_test_db())
+    cleaned = SQLGenerator._clean_sql("```sql\nSELECT * FROM customers -- every row\n```")
+    assert cleaned == f"SELECT * FROM customers\nLIMIT {MAX_QUERY_RESULTS}"
+    assert SQLGenerator._clean_sql("SELECT * FROM customers LIMIT 5;") == "SELECT * FROM customers LIMIT 5;"
+    # A trailing comment after the semicolon must not leave the LIMIT in a second statement
+    cleaned_after_semicolon = SQLGenerator._clean_sql("SELECT * FROM customers; -- all rows")
+    assert cleaned_after_semicolon == f"SELECT * FROM customers\nLIMIT {MAX_QUERY_RESULTS}"
+    
+    for query in (cleaned, cleaned_after_semicolon, "SELECT name FROM customers -- no LIMIT here",
+                  "SELECT name FROM customers WHERE name != 'LIMIT';", "SELECT city FROM customers; -- all cities",
+                  "SELECT city FROM customers /* no cap */ ;\n", "SELECT name FROM customers WHERE name != ';--'"):
+        df, error = db.execute_query(query)
+        assert not error and len(df) == MAX_QUERY_RESULTS, query
+    df, error = db.execute_query("SELECT name FROM customers LIMIT 5")
+    assert not error and len(df) == 5
+    # Leading NULLs don't turn a numeric column into object dtype
+    df, error = db.execute_query("SELECT CASE WHEN customer_id > 250 THEN customer_id END AS late_id FROM customers LIMIT 300")
+    assert not error and pd.api.types.is_integer_dtype(df["late_id"]) and df["late_id"].count() == 50
+    db.disconnect()
+
+def test_query_templates():
+    """Only unambiguous question shapes are answered locally; anything with a qualifier goes to the LLM."""
+    from config import MAX_QUERY_RESULTS
+    from database_manager import DatabaseManager
+    from sql_generator import SQLGenerator, _COUNT_TEMPLATE_RE, _TOP_N_TEMPLATE_RE, _LIST_TEMPLATE_RE
+    
+    for question in ("How many customers do we have?", "how many orders", "How many orders are there?", "count of the customers", "Number of orders?"):
+        assert _COUNT_TEMPLATE_RE.match(question), question
+    for question in ("How many customers are from California?", "how many orders are pending?",
+                     "How many orders were shipped in 2024?", "How many customers is too many?",
+                     "How many customers per city?", "how many customers do we have in NY?"):
+        assert not _COUNT_TEMPLATE_RE.match(question), question
+    
+    for question in ("Show me top 5 orders by total amount", "top 3 customers by name?", "the top 10 orders by total_amount"):
+        assert _TOP_N_TEMPLATE_RE.match(question), question
+    for question in ("top 5 orders by total amount in 2024", "top orders by total amount", "show me top 5 orders"):
+        assert not _TOP_N_TEMPLATE_RE.match(question), question
+    
+    for question in ("list customers", "Show me all the orders?", "show customers"):
+        assert _LIST_TEMPLATE_RE.match(question), question
+    for question in ("list customers in NY", "show me customers who ordered twice", "show me all the orders by total"):
+        assert not _LIST_TEMPLATE_RE.match(question), question
+    
+    generator = SQLGenerator(DatabaseManager(_make_test_db()), schema_info="")
+    assert generator._match_template("How many customers do we have?") == (
+        'SELECT COUNT(*) AS count FROM "customers"', "Counts the rows in the customers table.")
+    assert generator._match_template("show me top 3 orders by total amount")[0] == (
+        'SELECT * FROM "orders" ORDER BY "total_amount" DESC LIMIT 3')
+    assert generator._match_template("list customer")[0] == f'SELECT * FROM "customers" LIMIT {MAX_QUERY_RESULTS}'
+    # Words that don't resolve against the schema, and filtered questions, fall through
+    for question in ("how many widgets?", "top 3 orders by revenue", "How many customers are from California?"):
+        assert generator._match_template(question) is None, question
+    generator.db_manager.disconnect()
+
+def test_sql_cache_only_keeps_working_sql():
+    """Failing SQL is never cached; the corrected query is, so repeats skip both LLM calls."""
+    import json
+    import llm_client
+    from database_manager import DatabaseManager
+    from sql_generator import SQLGenerator
+    
+    saved = llm_client._disk_cache
+    llm_client._disk_cache = False  # Keep these entries in memory only
+    try:
+        generator = SQLGenerator(DatabaseManager(_make_test_db()), schema_info="cache test schema")
+        question = "which customers live where?"
+        cache_key, answer, _ = generator._lookup_sql_and_explanation(question)
+        assert answer is None
+        
+        broken = json.dumps({"sql": "SELECT town FROM customers", "explanation": "Lists towns."})
+        assert generator._store_sql_and_explanation(cache_key, broken) == ("SELECT town FROM customers", "Lists towns.")
+        assert generator._lookup_sql_and_explanation(question)[1] is None
+        
+        generator.remember_sql(question, "SELECT name, city FROM customers")
+        # The correction has no explanation until someone explains it
+        assert generator._lookup_sql_and_explanation(question)[1] == ("SELECT name, city FROM customers", "")
+        
+        working = json.dumps({"sql": "SELECT city FROM customers", "explanation": "Lists cities."})
+        generator._store_sql_and_explanation(cache_key, working)
+        assert generator._lookup_sql_and_explanation(question)[1] == ("SELECT city FROM customers", "Lists cities.")
+        generator.db_manager.disconnect()
+    finally:
+        llm_client._disk_cache = saved
+
 def main():
     """Run all tests."""
     print("=== Testing LLM Data Analyst Assistant Components ===\n")
@@ -97,6 +310,12 @@ def main():
     if not test_sql_generator():
         return False
     
+    print("\n4. Testing query safety and LLM helpers...")
+    for test in (test_authorizer, test_dry_run_and_validate_query, test_result_row_cap, test_query_templates,
+                 test_partial_json_string, test_response_cache, test_sql_cache_only_keeps_working_sql):
+        test()
+        print(f"✓ {test.__name__}")
+    
     print("\n=== All tests passed! ===")
     print("The application should work correctly.")
     print("Note: OpenAI features will be limited without API key, but basic functionality should work.")
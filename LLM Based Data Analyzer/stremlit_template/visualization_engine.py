@@ -1,16 +1,20 @@
+import warnings
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import streamlit as st
 
+# Number of leading non-null values that must parse as dates for a text column to count as dates
+DATE_SAMPLE_SIZE = 5
+
 class VisualizationEngine:
     """Automatically generates appropriate visualizations based on query results."""
     
     def __init__(self):
         self.color_palette = px.colors.qualitative.Set3
     
-    def create_visualization(self, df: pd.DataFrame, query: str) -> Optional[go.Figure]:
+    def create_visualization(self, df: pd.DataFrame, query: str) -> Tuple[Optional[go.Figure], Optional[str]]:
         """
         Automatically create appropriate visualization based on data characteristics.
         
@@ -19,51 +23,62 @@ class VisualizationEngine:
             query: Original SQL query for context
             
         Returns:
-            Plotly figure or None if visualization not suitable
+            Tuple of (figure, widget) where widget is "plotly" for a chart,
+            "dataframe" when the data is best shown as a table (left to
+            st.dataframe rather than serialized into a Plotly table), or
+            (None, None) if nothing suits the data
         """
         if df.empty or len(df.columns) < 1:
-            return None
+            return None, None
         
         try:
+            # Column types are scanned once and shared by the chart type decision and builders
+            ctx = self._column_types(df)
+            
             # Determine the best chart type based on data characteristics
-            chart_type = self._determine_chart_type(df, query)
+            chart_type = self._determine_chart_type(df, query, ctx)
             
             if chart_type == "bar":
-                return self._create_bar_chart(df)
+                fig = self._create_bar_chart(df, ctx)
             elif chart_type == "line":
-                return self._create_line_chart(df)
+                fig = self._create_line_chart(df, ctx)
             elif chart_type == "pie":
-                return self._create_pie_chart(df)
+                fig = self._create_pie_chart(df, ctx)
             elif chart_type == "scatter":
-                return self._create_scatter_plot(df)
+                fig = self._create_scatter_plot(df, ctx)
             elif chart_type == "table":
-                return self._create_table_visualization(df)
+                return None, "dataframe"
             else:
-                return None
+                return None, None
+            
+            # The bar chart (also the pie/scatter fallback) returns None without a
+            # numeric column to plot; show the table instead
+            return (fig, "plotly") if fig is not None else (None, "dataframe")
                 
         except Exception as e:
             st.error(f"Error creating visualization: {str(e)}")
-            return None
+            return None, None
+    
+    def _column_types(self, df: pd.DataFrame) -> Dict[str, List[str]]:
+        """Numeric, text and date column names, computed once per visualization."""
+        # The pandas.api.types checks treat NumPy and Arrow-backed dtypes alike
+        text_cols = [col for col in df.columns if pd.api.types.is_string_dtype(df[col])]
+        return {
+            'numeric': [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])],
+            'text': text_cols,
+            'dates': self._detect_date_columns(df, text_cols)
+        }
     
-    def _determine_chart_type(self, df: pd.DataFrame, query: str) -> str:
+    def _determine_chart_type(self, df: pd.DataFrame, query: str, ctx: Dict[str, List[str]]) -> str:
         """Determine the most appropriate chart type for the data."""
         
         num_cols = len(df.columns)
         num_rows = len(df)
         
         # Analyze column types
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        text_cols = df.select_dtypes(include=['object', 'string']).columns.tolist()
-        date_cols = []
-        
-        # Check for date columns
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                try:
-                    pd.to_datetime(df[col].iloc[0])
-                    date_cols.append(col)
-                except:
-                    pass
+        numeric_cols = ctx['numeric']
+        text_cols = ctx['text']
+        date_cols = ctx['dates']
         
         # Decision logic for chart type
         if num_rows > 50:
@@ -94,15 +109,35 @@ class VisualizationEngine:
         # Default to table for complex data
         return "table"
     
-    def _create_bar_chart(self, df: pd.DataFrame) -> go.Figure:
-        """Create a bar chart from the data."""
+    @staticmethod
+    def _detect_date_columns(df: pd.DataFrame, text_cols: List[str]) -> List[str]:
+        """Columns holding dates: datetime dtypes, plus text columns whose first values all parse as dates."""
+        # text_cols comes from _column_types, so object columns are not re-scanned
+        # to decide whether they hold strings
+        text_cols = set(text_cols)
+        date_cols = []
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                date_cols.append(col)
+            elif col in text_cols:
+                sample = df[col].dropna().head(DATE_SAMPLE_SIZE)
+                with warnings.catch_warnings():
+                    # Non-date text makes pandas warn that it cannot infer a format
+                    warnings.simplefilter("ignore", UserWarning)
+                    parsed = pd.to_datetime(sample, errors='coerce')
+                if len(sample) > 0 and parsed.notna().all():
+                    date_cols.append(col)
+        return date_cols
+    
+    def _create_bar_chart(self, df: pd.DataFrame, ctx: Dict[str, List[str]]) -> Optional[go.Figure]:
+        """Create a bar chart from the data, or None if there is no numeric column to plot."""
         
         # Find the best columns for x and y
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        text_cols = df.select_dtypes(include=['object', 'string']).columns.tolist()
+        numeric_cols = ctx['numeric']
+        text_cols = ctx['text']
         
         if not numeric_cols:
-            return self._create_table_visualization(df)
+            return None
         
         y_col = numeric_cols[0]  # First numeric column for y-axis
         x_col = text_cols[0] if text_cols else df.columns[0]  # First text column or first column for x-axis
@@ -123,24 +158,14 @@ class VisualizationEngine:
         
         return fig
     
-    def _create_line_chart(self, df: pd.DataFrame) -> go.Figure:
+    def _create_line_chart(self, df: pd.DataFrame, ctx: Dict[str, List[str]]) -> go.Figure:
         """Create a line chart for time series data."""
         
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+        numeric_cols = ctx['numeric']
         
         # Try to find date column
-        date_col = None
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                try:
-                    pd.to_datetime(df[col].iloc[0])
-                    date_col = col
-                    break
-                except:
-                    continue
-        
-        if not date_col:
-            date_col = df.columns[0]  # Use first column as x-axis
+        date_cols = ctx['dates']
+        date_col = date_cols[0] if date_cols else df.columns[0]  # Fall back to first column as x-axis
         
         y_col = numeric_cols[0] if numeric_cols else df.columns[1]
         
@@ -159,14 +184,14 @@ class VisualizationEngine:
         
         return fig
     
-    def _create_pie_chart(self, df: pd.DataFrame) -> go.Figure:
+    def _create_pie_chart(self, df: pd.DataFrame, ctx: Dict[str, List[str]]) -> Optional[go.Figure]:
         """Create a pie chart for categorical data with values."""
         
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        text_cols = df.select_dtypes(include=['object', 'string']).columns.tolist()
+        numeric_cols = ctx['numeric']
+        text_cols = ctx['text']
         
         if not numeric_cols or not text_cols:
-            return self._create_bar_chart(df)
+            return self._create_bar_chart(df, ctx)
         
         labels_col = text_cols[0]
         values_col = numeric_cols[0]
@@ -181,13 +206,13 @@ class VisualizationEngine:
         
         return fig
     
-    def _create_scatter_plot(self, df: pd.DataFrame) -> go.Figure:
+    def _create_scatter_plot(self, df: pd.DataFrame, ctx: Dict[str, List[str]]) -> Optional[go.Figure]:
         """Create a scatter plot for two numeric variables."""
         
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+        numeric_cols = ctx['numeric']
         
         if len(numeric_cols) < 2:
-            return self._create_bar_chart(df)
+            return self._create_bar_chart(df, ctx)
         
         x_col = numeric_cols[0]
         y_col = numeric_cols[1]
@@ -207,31 +232,6 @@ class VisualizationEngine:
         
         return fig
     
-    def _create_table_visualization(self, df: pd.DataFrame) -> go.Figure:
-        """Create a formatted table visualization."""
-        
-        fig = go.Figure(data=[go.Table(
-            header=dict(
-                values=list(df.columns),
-                fill_color='lightblue',
-                align='left',
-                font=dict(size=12, color='white')
-            ),
-            cells=dict(
-                values=[df[col].tolist() for col in df.columns],
-                fill_color='white',
-                align='left',
-                font=dict(size=11)
-            )
-        )])
-        
-        fig.update_layout(
-            title="Query Results",
-            height=min(400, 50 + len(df) * 30)  # Dynamic height based on rows
-        )
-        
-        return fig
-    
     def get_chart_summary(self, df: pd.DataFrame, chart_type: str) -> str:
         """Generate a summary of what the chart shows."""
         